@@ -32,6 +32,7 @@
 import gdb
 import itertools
 import re
+import struct
 
 class CxxSharedPointerPrinter:
     "Print a std::__1::shared_ptr or std::__1::weak_ptr"
@@ -62,19 +63,24 @@ class CxxUniquePtrPrinter:
     def display_hint (self):
         return "std::unique_ptr"
 
+def get_string_data(val):
+    "return (data pointer, length) of a std::__1::basic_string"
+    is_short = val['__r_']['__first_']['__s']['__size_'] & 1
+    if is_short == 0 :
+        ptr = val['__r_']['__first_']['__s']['__data_']
+        length = val['__r_']['__first_']['__s']['__size_'] / 2 % 256
+    else:
+        ptr = val['__r_']['__first_']['__l']['__data_']
+        length = val['__r_']['__first_']['__l']['__size_'] + 1
+    return ptr, length
+
 class CxxStringPrinter:
     "Print a std::__1::basic_string"
     def __init__(self, typename, val):
         self.val = val
 
     def to_string(self):
-        self.is_short = self.val['__r_']['__first_']['__s']['__size_'] & 1
-        if self.is_short == 0 :
-            self.ptr = self.val['__r_']['__first_']['__s']['__data_']
-            self.length = self.val['__r_']['__first_']['__s']['__size_'] / 2 % 256
-        else:
-            self.ptr = self.val['__r_']['__first_']['__l']['__data_']
-            self.length = self.val['__r_']['__first_']['__l']['__size_'] + 1
+        self.ptr, self.length = get_string_data(self.val)
         return ('"%s"' % (self.ptr.string (length = self.length)))
 
     def display_hint (self):
@@ -110,6 +116,17 @@ class CxxArrayPrinter:
         return self._iterator(self.val['__elems_'],
                               size)
 
+    def storage(self):
+        "element type and contiguous (index, address, count) chunks"
+        array_type = self.val['__elems_'].type
+        target = array_type.target()
+        try:
+            # array<T, 0> still lays out __elems_[1]
+            size = int(self.val.type.strip_typedefs().template_argument(1))
+        except (gdb.error, RuntimeError):
+            size = array_type.sizeof // target.sizeof
+        return target, [(0, int(self.val['__elems_'].address), size)]
+
     def to_string(self):
         array_type = self.val['__elems_'].type
         target = array_type.target()
@@ -148,6 +165,13 @@ class CxxVectorPrinter:
         return self._iterator(self.val['__begin_'],
                               self.val['__end_'])
 
+    def storage(self):
+        "element type and contiguous (index, address, count) chunks"
+        begin = self.val['__begin_']
+        end = self.val['__end_']
+        elemtype = begin.type.strip_typedefs().target()
+        return elemtype, [(0, int(begin), int(end - begin))]
+
     def to_string(self):
         begin = self.val['__begin_']
         end = self.val['__end_'] 
@@ -262,7 +286,23 @@ class CxxDequePrinter:
         size  = self.val['__size_']['__first_']
 
         return self._iterator(begin, offset, block, size)
-                              
+
+    def storage(self):
+        "element type and contiguous (index, address, count) chunks, one per block"
+        begin = self.val['__map_']['__first_']
+        block = int(self.val['__block_size'])
+        offset = int(self.val['__start_'])
+        size  = int(self.val['__size_']['__first_'])
+        chunks = []
+        count = 0
+        while count < size:
+            i, j = divmod(count + offset, block)
+            length = min(block - j, size - count)
+            ptr = (begin + i).dereference() + j
+            chunks.append((count, int(ptr), length))
+            count = count + length
+        elemtype = begin.type.strip_typedefs().target().strip_typedefs().target()
+        return elemtype, chunks
 
     def to_string(self):
         size = self.val['__size_']['__first_']
@@ -379,6 +419,147 @@ class CxxRbTreeIterator:
         self.begin = self.get_next_node(self.begin)
         return self.fmt(count, value)
 
+_key_string_limit = 256
+_key_string_regex = re.compile('^std::__1::(basic_string<char,.*>|string)$')
+_key_wide_char_names = ('wchar_t', 'char8_t', 'char16_t', 'char32_t')
+
+def get_byteorder():
+    "byte order of the current target, looked up on every call"
+    endian = gdb.execute('show endian', to_string = True)
+    if 'big endian' in endian:
+        return 'big'
+    return 'little'
+
+def is_char_type(keytype):
+    "types gdb prints as characters, including wchar_t typed as an int"
+    keytype = keytype.strip_typedefs()
+    if keytype.code == gdb.TYPE_CODE_CHAR:
+        return True
+    if keytype.code != gdb.TYPE_CODE_INT:
+        return False
+    return keytype.sizeof == 1 \
+            or str(keytype.unqualified()) in _key_wide_char_names
+
+def read_raw_int(value, signed, byteorder):
+    "decode an integer straight from the inferior memory"
+    size = value.type.sizeof
+    data = gdb.selected_inferior().read_memory(value.address, size)
+    return int.from_bytes(bytes(data), byteorder, signed = signed)
+
+def make_int_key_formatter(keytype, byteorder):
+    signed = keytype.is_signed
+    def fmt(value):
+        return '%d' % read_raw_int(value, signed, byteorder)
+    return fmt
+
+def make_bool_key_formatter(byteorder):
+    def fmt(value):
+        if read_raw_int(value, False, byteorder):
+            return 'true'
+        return 'false'
+    return fmt
+
+def make_pointer_key_formatter(byteorder):
+    def fmt(value):
+        return '0x%x' % read_raw_int(value, False, byteorder)
+    return fmt
+
+def is_flag_enum(enumerators):
+    """
+    enumerators are non-negative, distinct and use disjoint bits, which is
+    how gdb decides to print unknown values as (A | B)
+    """
+    numbers = [number for (number, name) in enumerators]
+    if len(set(numbers)) != len(numbers):
+        return False
+    seen = 0
+    for number in numbers:
+        if number < 0 or number & seen:
+            return False
+        seen = seen | number
+    return True
+
+def make_enum_key_formatter(keytype, byteorder):
+    enumerators = [(field.enumval, field.name) for field in keytype.fields()]
+    names = {}
+    for (number, name) in enumerators:
+        names.setdefault(number, name)
+    signed = keytype.is_signed
+    flags = is_flag_enum(enumerators)
+    def fmt(value):
+        number = read_raw_int(value, signed, byteorder)
+        if number in names:
+            return names[number]
+        if not flags or number <= 0:
+            return '%d' % number
+        parts = []
+        for (flag, name) in enumerators:
+            if flag != 0 and number & flag == flag:
+                parts.append(name)
+                number = number & ~flag
+        if number:
+            parts.append('unknown: 0x%x' % number)
+        return '(%s)' % ' | '.join(parts)
+    return fmt
+
+def format_string_key(value):
+    ptr, length = get_string_data(value)
+    length = int(length)
+    limit = min(length, _key_string_limit)
+    if ptr.type.strip_typedefs().code == gdb.TYPE_CODE_ARRAY:
+        address = int(ptr.address)
+    else:
+        address = int(ptr)
+    data = bytes(gdb.selected_inferior().read_memory(address, limit))
+    text = data.decode('utf-8', 'backslashreplace')
+    if limit < length:
+        return '"%s"...' % text
+    return '"%s"' % text
+
+def format_key_default(value):
+    return '%s' % value
+
+def get_key_formatter(keytype):
+    """
+    pick a fast formatter for a map key type, decoding raw bytes instead
+    of going through gdb's value formatting. character keys (wchar_t
+    included) and pointers to them are left to gdb, since it prints them
+    with their character/string. called once per children(), so the byte
+    order and enum table always match the current target.
+    """
+    keytype = keytype.strip_typedefs()
+    name = str(keytype.unqualified())
+    code = keytype.code
+    if is_char_type(keytype):
+        return format_key_default
+    if code == gdb.TYPE_CODE_INT and hasattr(keytype, 'is_signed'):
+        return make_int_key_formatter(keytype, get_byteorder())
+    if code == gdb.TYPE_CODE_BOOL:
+        return make_bool_key_formatter(get_byteorder())
+    if code == gdb.TYPE_CODE_ENUM and hasattr(keytype, 'is_signed'):
+        return make_enum_key_formatter(keytype, get_byteorder())
+    if code == gdb.TYPE_CODE_PTR and not is_char_type(keytype.target()):
+        return make_pointer_key_formatter(get_byteorder())
+    if _key_string_regex.match(name) is not None:
+        return format_string_key
+    return format_key_default
+
+def get_node_key_type(nodetype):
+    "key type of the pair stored in a map / unordered_map node"
+    node = nodetype.strip_typedefs().target().strip_typedefs()
+    value = node['__value_'].type.strip_typedefs()
+    pair = value['__cc'].type.strip_typedefs()
+    return pair['first'].type
+
+def format_key(value, fmt):
+    "render a map key for a child name, falling back to gdb formatting"
+    if fmt is not format_key_default and value.address is not None:
+        try:
+            return fmt(value)
+        except gdb.MemoryError:
+            pass
+    return format_key_default(value)
+
 class CxxMapPrinter:
     "std::__1::map and std::multiset"
 
@@ -390,7 +571,8 @@ class CxxMapPrinter:
         begin = self.val['__tree_']['__begin_node_']
         nodetype = begin.type
         size = self.val['__tree_']['__pair3_']['__first_']
-        fmt = lambda count,value : ('[%s]' % value['first'], value['second'])
+        key_fmt = get_key_formatter(get_node_key_type(nodetype))
+        fmt = lambda count,value : ('[%s]' % format_key(value['first'], key_fmt), value['second'])
         return CxxRbTreeIterator(nodetype, begin, size, fmt)
 
     def to_string(self):
@@ -478,7 +660,8 @@ class CxxUnorderedMapPrinter:
         begin = self.val['__table_']['__p1_']['__first_']['__next_']
         nodetype = begin.type
         size = self.val['__table_']['__p2_']['__first_']
-        fmt = lambda count,value : ('[%s]' % value['first'], value['second'])
+        key_fmt = get_key_formatter(get_node_key_type(nodetype))
+        fmt = lambda count,value : ('[%s]' % format_key(value['first'], key_fmt), value['second'])
         return CxxUnorderedIterator(nodetype, begin, size, fmt)
 
     def to_string(self):
@@ -628,6 +811,186 @@ class CxxUnorederedSetIterPrinter:
     def display_hint (self):
         return "std::__1::__hash_set_iterator"
 
+_grep_formats = {
+    (gdb.TYPE_CODE_INT, 1, True) : 'b', (gdb.TYPE_CODE_INT, 1, False) : 'B',
+    (gdb.TYPE_CODE_INT, 2, True) : 'h', (gdb.TYPE_CODE_INT, 2, False) : 'H',
+    (gdb.TYPE_CODE_INT, 4, True) : 'i', (gdb.TYPE_CODE_INT, 4, False) : 'I',
+    (gdb.TYPE_CODE_INT, 8, True) : 'q', (gdb.TYPE_CODE_INT, 8, False) : 'Q',
+    (gdb.TYPE_CODE_FLT, 4, True) : 'f', (gdb.TYPE_CODE_FLT, 8, True) : 'd',
+}
+
+_grep_usage = 'usage: libcxx-grep EXPR VALUE|LO..HI [LIMIT]'
+
+# elements read from the inferior per memory access
+_grep_chunk_elements = 1 << 20
+
+def get_grep_signedness(elemtype):
+    """
+    signedness of an integer element type, or None when it cannot be told.
+    older gdbs have no Type.is_signed, so fall back to the type name there;
+    plain char and enums are implementation defined and are refused.
+    """
+    if hasattr(elemtype, 'is_signed'):
+        return elemtype.is_signed
+    if elemtype.code == gdb.TYPE_CODE_ENUM:
+        return None
+    name = str(elemtype.unqualified())
+    if 'unsigned' in name or name in ('char8_t', 'char16_t', 'char32_t'):
+        return False
+    if name in ('char', 'wchar_t'):
+        return None
+    return True
+
+def get_grep_format(elemtype):
+    "struct format character for a searchable element type, or None"
+    elemtype = elemtype.strip_typedefs()
+    code = elemtype.code
+    signed = True
+    if code in (gdb.TYPE_CODE_CHAR, gdb.TYPE_CODE_ENUM, gdb.TYPE_CODE_INT):
+        code = gdb.TYPE_CODE_INT
+        signed = get_grep_signedness(elemtype)
+        if signed is None:
+            return None
+    elif code in (gdb.TYPE_CODE_BOOL, gdb.TYPE_CODE_PTR):
+        code = gdb.TYPE_CODE_INT
+        signed = False
+    return _grep_formats.get((code, elemtype.sizeof, signed))
+
+def grep_chunks(chunks, size):
+    "split storage chunks into pieces small enough to read at once"
+    for (index, address, count) in chunks:
+        while count > 0:
+            length = min(count, _grep_chunk_elements)
+            yield index, address, length
+            index = index + length
+            address = address + length * size
+            count = count - length
+
+def grep_exact(data, needle, size):
+    "element offsets in data whose bytes equal needle"
+    pos = data.find(needle)
+    while pos >= 0:
+        if pos % size == 0:
+            yield pos // size
+            pos = pos + size
+        else:
+            pos = pos + 1
+        pos = data.find(needle, pos)
+
+_grep_numpy = None
+
+def get_numpy():
+    "numpy module, or False when it is not installed; imported on first use"
+    global _grep_numpy
+    if _grep_numpy is None:
+        try:
+            import numpy
+            _grep_numpy = numpy
+        except ImportError:
+            _grep_numpy = False
+    return _grep_numpy
+
+def grep_range(data, order, fmt, lo, hi):
+    "element offsets in data whose value lies in [lo, hi]"
+    numpy = get_numpy()
+    if numpy:
+        dtype = numpy.dtype(fmt).newbyteorder(order)
+        values = numpy.frombuffer(data, dtype = dtype)
+        return numpy.flatnonzero((values >= lo) & (values <= hi)).tolist()
+    values = struct.iter_unpack(order + fmt, data)
+    return [i for i, (v,) in enumerate(values) if lo <= v <= hi]
+
+class CxxGrepCommand(gdb.Command):
+    """
+    Search a std::__1::vector, std::__1::array or std::__1::deque for a value.
+
+    Usage: libcxx-grep EXPR VALUE|LO..HI [LIMIT]
+
+    Prints the index and address of every element equal to VALUE, or in the
+    inclusive range LO..HI, stopping after LIMIT matches (default 100).
+    Elements must be integers, enums, pointers or floating point numbers;
+    floating point values compare numerically, so 0 also finds -0.0.
+    """
+
+    def __init__(self):
+        super(CxxGrepCommand, self).__init__('libcxx-grep', gdb.COMMAND_DATA)
+
+    def parse_value(self, text, fmt):
+        value = gdb.parse_and_eval(text)
+        if fmt in 'fd':
+            return float(value)
+        if value.type.strip_typedefs().code == gdb.TYPE_CODE_FLT:
+            raise gdb.GdbError('libcxx-grep: %s is not an integer' % text)
+        return int(value)
+
+    def lookup_printer(self, val):
+        "container printer for val, seen through references and cv-qualifiers"
+        refs = (gdb.TYPE_CODE_REF, getattr(gdb, 'TYPE_CODE_RVALUE_REF', None))
+        if val.type.strip_typedefs().code in refs:
+            val = val.referenced_value()
+        typename = str(val.type.strip_typedefs().unqualified())
+        for (regex, Printer) in _type_parse_map:
+            if regex.match(typename) is not None:
+                return Printer(typename, val)
+        return None
+
+    def invoke(self, arg, from_tty):
+        argv = gdb.string_to_argv(arg)
+        if len(argv) not in (2, 3):
+            raise gdb.GdbError(_grep_usage)
+        limit = 100
+        if len(argv) == 3:
+            try:
+                limit = int(argv[2])
+            except ValueError:
+                raise gdb.GdbError(_grep_usage)
+            if limit < 1:
+                raise gdb.GdbError(_grep_usage)
+
+        val = gdb.parse_and_eval(argv[0])
+        printer = self.lookup_printer(val)
+        if printer is None or not hasattr(printer, 'storage'):
+            raise gdb.GdbError('libcxx-grep: %s is not a vector, array or deque'
+                               % val.type)
+        elemtype, chunks = printer.storage()
+        fmt = get_grep_format(elemtype)
+        if fmt is None:
+            raise gdb.GdbError('libcxx-grep: cannot search elements of type %s'
+                               % elemtype)
+        size = struct.calcsize(fmt)
+        order = '>' if get_byteorder() == 'big' else '<'
+
+        if '..' in argv[1]:
+            lo, hi = argv[1].split('..', 1)
+            if not lo.strip() or not hi.strip():
+                raise gdb.GdbError(_grep_usage)
+            lo, hi = self.parse_value(lo, fmt), self.parse_value(hi, fmt)
+            search = lambda data : grep_range(data, order, fmt, lo, hi)
+        else:
+            try:
+                needle = struct.pack(order + fmt, self.parse_value(argv[1], fmt))
+            except (struct.error, OverflowError):
+                raise gdb.GdbError('libcxx-grep: %s does not fit in %s'
+                                   % (argv[1], elemtype))
+            if fmt in 'fd':
+                # bytes differ for 0.0 and -0.0, compare numerically instead
+                value = struct.unpack(order + fmt, needle)[0]
+                search = lambda data : grep_range(data, order, fmt, value, value)
+            else:
+                search = lambda data : grep_exact(data, needle, size)
+
+        inferior = gdb.selected_inferior()
+        found = 0
+        for (index, address, count) in grep_chunks(chunks, size):
+            data = bytes(inferior.read_memory(address, count * size))
+            for i in search(data):
+                if found == limit:
+                    gdb.write('(stopped after %d matches)\n' % limit)
+                    return
+                gdb.write('[%d] 0x%x\n' % (index + i, address + i * size))
+                found = found + 1
+        gdb.write('%d matches\n' % found)
+
 _type_parse_map = []
 
 def reg_function(regex, parse):
@@ -682,6 +1045,7 @@ def register_libcxx_printers(obj):
         reg_function('^std::__1::__hash_map_iterator<.*>$', CxxUnorederedMapIterPrinter)
         reg_function('^std::__1::__hash_map_const_iterator<.*>$', CxxUnorederedMapIterPrinter)
         reg_function('^std::__1::__hash_const_iterator<.*>$', CxxUnorederedSetIterPrinter)
+        CxxGrepCommand()
 
     if obj is None:
         obj = gdb